@@ -3,24 +3,36 @@
 """This module can be used to generate text to speech using Google Translate's
 text-to-speech API in bulk.
 
-This uses the gTTS library to generate audio and pydub to save it.
+This uses the gTTS library to generate audio and ffmpeg to save it.
 The reason you might use this module is to automatically generate a lot of words.
 This module will automatically retry if anything goes wrong when generating audio.
 """
 
+# pylint: disable=too-many-lines
+
 import argparse
+import base64
+import concurrent.futures
 import copy
 import dataclasses
-import io
+import hashlib
+import itertools
+import json
 import os
+import queue
+import re
+import shutil
+import string
+import subprocess
+import tempfile
 import threading
 import time
 import traceback
-from typing import List
+import urllib.parse
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 import gtts
 import progressbar
-import pydub
 import requests
 from strfseconds import strfseconds
 
@@ -32,6 +44,54 @@ _DEFAULT_BITRATE = "16k"
 _DEFAULT_MAX_PER_SEC = 5.0
 _DEFAULT_LANGUAGE = "en"
 _DEFAULT_TLD = "com"
+_DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "tts-generator"
+)
+_DEFAULT_MAX_CACHE_BYTES = 512 * 1024 * 1024
+_DEFAULT_BATCH_SIZE = 1
+
+# Suffix of files which are still being written
+_PARTIAL_SUFFIX = ".part"
+
+# The maximum number of words each writer transcodes at once
+_MAX_BATCH_SIZE = 64
+
+# Schemes that word lists can be downloaded with
+_URL_SCHEMES = ("http", "https")
+# Timeout in seconds for downloading word lists from URLs
+_URL_TIMEOUT = 10
+
+# Size in bytes of the chunks that word lists are downloaded and split in
+_URL_CHUNK_SIZE = 64 * 1024
+
+# Timeout in seconds for opening the first connection to the TTS API
+_WARM_UP_TIMEOUT = 5
+
+# Path of the TTS API on the Google Translate host
+_TTS_API_PATH = "_/TranslateWebserverUi/data/batchexecute"
+# Stands in for the text when building the parts of a request that don't
+# change. JSON and URL encoding leave it as it is
+_TEXT_PLACEHOLDER = "TEXTPLACEHOLDER"
+# Pattern used by gTTS to find text with nothing to speak in it
+_ALL_PUNCTUATION_OR_SPACE = re.compile(
+    f"^[{re.escape(gtts.tokenizer.symbols.ALL_PUNC + string.whitespace)}]*$"
+)
+# Pattern used by gTTS to find the audio in a TTS API response. The patterns
+# match the raw response, since the audio is base64 and decoding the whole
+# response to text first would only add another copy of it
+_AUDIO_PATTERN = re.compile(rb'jQ1olc","\[\\"(.*)\\"]')
+# Pattern to find the audio of each numbered RPC in a batched response
+_BATCH_AUDIO_PATTERN = re.compile(rb'jQ1olc","\[\\"([^"\\]*)\\"]"[^\]]*"(\d+)"]')
+
+# Time in seconds to back off for after the first failed request
+_INITIAL_RETRY_TIMEOUT = 5
+# Number of times a word is requested before it's skipped when the API answers
+# but doesn't return audio for it
+_MAX_WORD_ATTEMPTS = 3
+# Status codes which mean the API is unavailable rather than that something is
+# wrong with the word
+_TOO_MANY_REQUESTS = 429
+_SERVER_ERROR = 500
 
 # Timeout information formatting
 _TIMEOUT_FSTRING = "%h:%m2:%s2"
@@ -43,7 +103,8 @@ class TextToSpeechConfig:  # pylint: disable=too-many-instance-attributes
     Configuration for the TextToSpeech class.
 
     Args:
-        bitrate (str): The bitrate of the generated audio.
+        bitrate (str): The bitrate of the generated audio. Only used when the
+            audio is transcoded.
         progress_bar (bool): Whether to show a progress bar while generating.
         output_dir (str): The directory to output the files to.
         filetype (str): The filetype to write.
@@ -51,6 +112,19 @@ class TextToSpeechConfig:  # pylint: disable=too-many-instance-attributes
         max_per_second (float): The maximum number of requests per second.
         language (str): The langauge to generate audio in.
         locale (str): The locale/accent to generate audio in.
+        cache_dir (Optional[str]): The directory to cache generated audio in.
+            Caching is disabled if this is None.
+        max_cache_bytes (int): The maximum size of the cache. The least recently
+            used files are removed once this is exceeded.
+        force_transcode (bool): Whether to transcode mp3 audio to the given
+            bitrate. gTTS already returns ~32 kb/s mp3 audio, so this is only
+            needed to reduce the size of the files.
+        batch_size (int): The maximum number of words to send in each request.
+            Words missing from a batched response, or in a batch that fails,
+            are requested on their own.
+
+    Raises:
+        ValueError: If the number of threads or the batch size is less than 1.
     """
 
     bitrate: str = _DEFAULT_BITRATE
@@ -61,9 +135,250 @@ class TextToSpeechConfig:  # pylint: disable=too-many-instance-attributes
     max_per_second: float = _DEFAULT_MAX_PER_SEC
     language: str = _DEFAULT_LANGUAGE
     locale: str = _DEFAULT_TLD
+    cache_dir: Optional[str] = None
+    max_cache_bytes: int = _DEFAULT_MAX_CACHE_BYTES
+    force_transcode: bool = False
+    batch_size: int = _DEFAULT_BATCH_SIZE
+
+    def __post_init__(self):
+        if self.n_threads < 1:
+            raise ValueError(
+                f"Number of threads must be at least 1, not {self.n_threads}"
+            )
+        if self.batch_size < 1:
+            raise ValueError(f"Batch size must be at least 1, not {self.batch_size}")
+
+
+class _TTSClient:
+    """Client for Google Translate's TTS API.
+
+    gTTS builds a new request, including the URL and headers, for every word
+    it generates and sends it using a new session. The client builds the URL
+    once and sends every request through a shared session, which keeps the
+    connections alive between words.
+    """
+
+    def __init__(self, session: requests.Session, language: str, locale: str):
+        self._session = session
+        # Let gTTS check the language and replace it if it's deprecated, so
+        # an unsupported language fails here rather than on every request
+        template = gtts.gTTS(_TEXT_PLACEHOLDER, lang=language, tld=locale)
+        self._language = template.lang
+        self._pre_processors = template.pre_processor_funcs
+        self._locale = locale
+        self._url = f"https://translate.google.{locale}/{_TTS_API_PATH}"
+        self._body_start, self._body_end = self._get_body_template()
+
+    def get_audio(self, text: str) -> bytes:
+        """Generate mp3 audio of the text.
 
+        Args:
+            text (str): The text to generate audio for.
+
+        Raises:
+            gtts.tts.gTTSError: When there's an error with the API request.
+            ValueError: When the text has nothing to speak.
+
+        Returns:
+            bytes: The mp3 audio.
+        """
+        return b"".join(self._request_audio(body) for body in self._get_bodies(text))
+
+    def get_audio_batch(self, texts: List[str]) -> List[Optional[bytes]]:
+        """Generate mp3 audio of several texts in a single request.
+
+        Args:
+            texts (List[str]): The texts to generate audio for.
 
-class TextToSpeech:
+        Raises:
+            gtts.tts.gTTSError: When there's an error with the API request.
+
+        Returns:
+            List[Optional[bytes]]: The mp3 audio of each text, or None if the
+                text is too long to batch or is missing from the response.
+        """
+        if len(texts) == 1:
+            return [self.get_audio(texts[0])]
+        # Each text gets its own RPC in the request, numbered so that its
+        # audio can be found in the response. Text that needs to be split up,
+        # or that has nothing to speak, is left to be requested on its own.
+        cleaned_texts = [self._clean_text(text) for text in texts]
+        rpcs = [
+            [
+                gtts.gTTS.GOOGLE_TTS_RPC,
+                json.dumps(
+                    [cleaned_text.strip(), self._language, None, "null"],
+                    separators=(",", ":"),
+                ),
+                None,
+                str(index),
+            ]
+            for index, cleaned_text in enumerate(cleaned_texts)
+            if len(cleaned_text) <= gtts.gTTS.GOOGLE_TTS_MAX_CHARS
+            and self.has_speech(cleaned_text)
+        ]
+        if not rpcs:
+            return [None] * len(texts)
+        rpc = json.dumps([rpcs], separators=(",", ":"))
+        response = self._post(f"f.req={urllib.parse.quote(rpc)}&")
+        batch_audio = {
+            int(index): base64.b64decode(audio)
+            for audio, index in _BATCH_AUDIO_PATTERN.findall(response.content)
+        }
+        return [batch_audio.get(index) for index in range(len(texts))]
+
+    def has_speech(self, text: str) -> bool:
+        """Check whether there's anything to speak in the text.
+
+        Args:
+            text (str): The text to check.
+
+        Returns:
+            bool: False if the text is only punctuation and whitespace once it
+                has been cleaned up, which gTTS won't send.
+        """
+        return not _ALL_PUNCTUATION_OR_SPACE.match(self._clean_text(text))
+
+    def _clean_text(self, text: str) -> str:
+        # Clean up the text the same way gTTS does before sending it, such as
+        # expanding abbreviations
+        text = text.strip()
+        for pre_processor in self._pre_processors:
+            text = pre_processor(text)
+        return text
+
+    def _get_bodies(self, text: str) -> List[str]:
+        cleaned_text = self._clean_text(text)
+        if len(cleaned_text) > gtts.gTTS.GOOGLE_TTS_MAX_CHARS:
+            # Long text needs to be split over multiple requests, so leave
+            # that to gTTS
+            return gtts.gTTS(text, lang=self._language, tld=self._locale).get_bodies()
+        if not self.has_speech(text):
+            raise ValueError(f"No text to speak in {text!r}")
+        # The text is JSON encoded twice, since the parameter is a JSON string
+        # inside the RPC, and then URL encoded like the rest of the body
+        encoded_text = json.dumps(json.dumps(cleaned_text.strip())[1:-1])[1:-1]
+        return [f"{self._body_start}{urllib.parse.quote(encoded_text)}{self._body_end}"]
+
+    def _get_body_template(self) -> Tuple[str, str]:
+        # Everything except the text is the same for every request, so encode
+        # it once and split it around a placeholder for the text
+        parameter = json.dumps(
+            [_TEXT_PLACEHOLDER, self._language, None, "null"], separators=(",", ":")
+        )
+        rpc = json.dumps(
+            [[[gtts.gTTS.GOOGLE_TTS_RPC, parameter, None, "generic"]]],
+            separators=(",", ":"),
+        )
+        body_start, body_end = f"f.req={urllib.parse.quote(rpc)}&".split(
+            _TEXT_PLACEHOLDER
+        )
+        return body_start, body_end
+
+    def _request_audio(self, body: str) -> bytes:
+        response = self._post(body)
+        audio_search = _AUDIO_PATTERN.search(response.content)
+        if not audio_search:
+            # Good response, but no audio in it
+            raise gtts.tts.gTTSError("No audio in TTS API response", response=response)
+        return base64.b64decode(audio_search.group(1))
+
+    def _post(self, body: str) -> requests.Response:
+        try:
+            response = self._session.post(
+                self._url, data=body, headers=gtts.gTTS.GOOGLE_TTS_HEADERS
+            )
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as error:
+            raise gtts.tts.gTTSError(
+                f"{response.status_code} ({response.reason}) from TTS API",
+                response=response,
+            ) from error
+        except requests.exceptions.RequestException as error:
+            raise gtts.tts.gTTSError(f"Failed to connect: {error}") from error
+        return response
+
+
+class _TokenBucket:  # pylint: disable=too-few-public-methods
+    """Thread safe token bucket for limiting the rate of requests.
+
+    Tokens are refilled at a constant rate, up to the capacity of the bucket.
+    Every request takes a token, waiting for one to be refilled if the bucket
+    is empty.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            refilled = (now - self._last_refill) * self._rate
+            self._tokens = min(self._capacity, self._tokens + refilled)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            # Holding the lock while waiting makes the other threads queue
+            # up behind this one
+            wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+            # Count from when the token was due rather than when the sleep
+            # ended, so that oversleeping doesn't lower the rate
+            self._tokens = 0
+            self._last_refill = now + wait
+
+
+class _CircuitBreaker:
+    """Thread safe circuit breaker for backing off from a failing API.
+
+    The first failed request opens the breaker, which holds back requests from
+    every thread until it closes again after a timeout. The timeout doubles
+    each time the breaker opens, until a request succeeds.
+    """
+
+    def __init__(self, initial_timeout: float):
+        self._initial_timeout = initial_timeout
+        self._timeout = initial_timeout
+        self._closed = threading.Event()
+        self._closed.set()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Wait until the breaker is closed."""
+        self._closed.wait()
+
+    def trip(self) -> Optional[float]:
+        """Open the breaker, unless another thread already has.
+
+        Returns:
+            Optional[float]: The time in seconds until the breaker closes, or
+                None if it was already open.
+        """
+        with self._lock:
+            # Threads that fail during the same outage share one back off
+            if not self._closed.is_set():
+                return None
+            timeout = self._timeout
+            self._closed.clear()
+            timer = threading.Timer(timeout, self._closed.set)
+            timer.daemon = True
+            timer.start()
+            self._timeout = round(timeout * 2, 2)  # double the timeout each time
+            return timeout
+
+    def reset(self):
+        """Start backing off from the initial timeout again."""
+        with self._lock:
+            self._timeout = self._initial_timeout
+
+
+class TextToSpeech:  # pylint: disable=too-many-instance-attributes
     """
     Text to Speech generator.
 
@@ -75,76 +390,141 @@ class TextToSpeech:
         """Text to speech generator setup.
 
         Stores the config and initialises an empty word list.
-        If overwrite is False, will create a list of words that have already been
-        generated so they aren't generated again.
+        If overwrite is False, words that have already been generated in the
+        output directory won't be generated again when running. If it's True,
+        every word is generated again rather than copied from the cache.
 
         Args:
             config (TextToSpeechConfig): The settings for this TextToSpeech instance.
             overwrite (bool, optional): Whether to overwrite existing files in
                                         the output directory. Defaults to False.
+
+        Raises:
+            ValueError: If the language isn't supported.
         """
         self._config = copy.copy(config)  # copy so this can't be changed on the fly
+        self._overwrite = overwrite
         self.reset_words()
         self._reset_progress_tracker()
 
-        self._existing_files = []
-        if not overwrite:
-            filename_end = f".{self._config.filetype}"
-            listed_files = os.listdir(self._config.output_dir)
-            for filename in listed_files:
-                if filename.endswith(filename_end):
-                    filename_no_ext = filename.rsplit(filename_end, 1)[0]
-                    self._existing_files.append(filename_no_ext)
+        # Reuse connections to the TTS API and word list URLs across words
+        # and threads
+        self._session = requests.Session()
+        self._session.mount(
+            "https://",
+            requests.adapters.HTTPAdapter(pool_maxsize=self._config.n_threads),
+        )
+
+        self._client = _TTSClient(
+            self._session, self._config.language, self._config.locale
+        )
+        # Where users can solve a CAPTCHA if Google starts blocking requests
+        self._translate_url = f"https://translate.google.{self._config.locale}/"
+        # Built once rather than for every word
+        self._output_prefix = os.path.join(self._config.output_dir, "")
+
+        # Shared by all threads so requests are sent at an even rate
+        self._rate_limiter = _TokenBucket(self._config.max_per_second)
+        # Shared by all threads so they back off together when requests fail
+        self._circuit_breaker = _CircuitBreaker(_INITIAL_RETRY_TIMEOUT)
+
+        # Audio waiting to be written. This is bounded so that the requests
+        # can't get too far ahead of the writers.
+        self._write_queue = queue.Queue(maxsize=2 * self._config.n_threads)
+        # The first error raised while writing, to be raised once the writers
+        # have stopped
+        self._write_error: Optional[Exception] = None
+
+        if self._config.cache_dir is not None:
+            os.makedirs(self._config.cache_dir, exist_ok=True)
+        # The settings which affect the audio are the same for every word
+        self._cache_key_settings = "|".join(
+            (
+                self._config.language,
+                self._config.locale,
+                self._config.bitrate if self._needs_transcode() else "",
+                self._config.filetype,
+            )
+        )
 
     def run(self):
         """Run the text to speech generator.
 
         Send requests to the Google TTS server and write the output to files.
         Automatically retries if a request fails or gets blocked due to
-        excessive requests.
+        excessive requests. Words which already have files in the output
+        directory are removed from the words unless overwrite is set.
 
         Raises:
             ValueError: If there are no words to process.
+            Exception: The first error raised while writing audio. The rest of
+                the words are still written before it is raised.
         """
         if not self._words:
             raise ValueError("No words to process")
 
-        # Filter out words that we don't want to overwrite
-        words = self._words.difference(self._existing_files)
-
-        # Convert words to something indexable
-        words = list(words)
+        # Filter out words that we don't want to overwrite. This is done in
+        # place to avoid copying the whole set of words.
+        if not self._overwrite:
+            self._words.difference_update(self._get_existing_files())
 
         self._reset_progress_tracker()
-
-        # The timeout for running each thread
-        thread_timeout = self._config.n_threads / self._config.max_per_second
-
-        # Split the word lists for each thread
-        split_word_list = [
-            words[i :: self._config.n_threads] for i in range(self._config.n_threads)
-        ]
+        self._write_error = None
+        self._warm_up_session()
 
         threads = []
+        writer_threads = []
 
-        self._create_progress_bar_thread(len(words), thread_timeout, threads)
+        self._create_progress_bar_thread(len(self._words), threads)
 
-        for index, word_list in enumerate(split_word_list):
-            self._create_process_word_thread(word_list, thread_timeout, index, threads)
-            # Offset thread start times so they run at evenly spaced intervals
-            time.sleep(1 / self._config.max_per_second)
+        for _ in range(self._get_n_writer_threads()):
+            self._create_write_audio_thread(writer_threads)
+
+        try:
+            # Threads take the next batch as soon as they finish the last one,
+            # so a slow word doesn't hold up the words behind it. The batches
+            # are made as they're taken rather than all up front.
+            batches = self._get_batches()
+            batches_lock = threading.Lock()
+            stop = threading.Event()
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._config.n_threads
+            ) as executor:
+                futures = [
+                    executor.submit(self._process_batches, batches, batches_lock, stop)
+                    for _ in range(self._config.n_threads)
+                ]
+                # Wait for the results so that any errors are raised here
+                for future in futures:
+                    future.result()
+        finally:
+            # All of the audio has been queued, so the writers can stop
+            for _ in writer_threads:
+                self._write_queue.put(None)
+            for thread in writer_threads:
+                thread.join()
 
         for thread in threads:
             thread.join()
 
+        self._prune_cache()
+
+        if self._write_error is not None:
+            raise self._write_error
+
     def add_words_from_files(self, filenames: List[str]):
         """Parse a list of files and add words from them.
 
         Args:
             filenames (List[str]): The filenames to add words from.
         """
-        for filename in filenames:
-            self.add_words_from_file(filename)
+        # Read the files at the same time so that slow disks or network
+        # drives are waited on together
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._config.n_threads
+        ) as executor:
+            for words in executor.map(self._read_words_from_file, filenames):
+                self.add_words(words)
 
     def add_words_from_file(self, filename: str):
         """Parse a file and add words from it.
@@ -152,11 +532,7 @@ class TextToSpeech:
         Args:
             filename (str): The filename to add words from.
         """
-        try:
-            with open(filename, "r", encoding="utf-8") as file:
-                self.add_words(self._parse_word_list(file.read()))
-        except FileNotFoundError:
-            print(f"File {filename} is not found")
+        self.add_words(self._read_words_from_file(filename))
 
     def add_words_from_urls(self, urls: List[str]):
         """Download files and add words from them.
@@ -164,8 +540,13 @@ class TextToSpeech:
         Args:
             urls (List[str]): The files to download and parse.
         """
-        for url in urls:
-            self.add_words_from_url(url)
+        # Download the files at the same time, since most of the time is spent
+        # waiting on the network
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._config.n_threads
+        ) as executor:
+            for words in executor.map(self._read_words_from_url, urls):
+                self.add_words(words)
 
     def add_words_from_url(self, url: str):
         """Download a file and add the words from it.
@@ -173,23 +554,57 @@ class TextToSpeech:
         Args:
             url (str): The file to download and parse.
         """
-        try:
-            response = requests.get(url)
-        except requests.exceptions.MissingSchema:
-            print(f"URL {url} is invalid")
-            return
+        self.add_words(self._read_words_from_url(url))
 
-        if not response.ok:
-            print(f"URL {url} returned {response}")
-            return
+    def _read_words_from_file(self, filename: str) -> List[str]:
+        try:
+            with open(filename, "r", encoding="utf-8") as file:
+                # Read the file line by line rather than all at once
+                return list(self._parse_words(file))
+        except FileNotFoundError:
+            print(f"File {filename} is not found")
+            return []
 
-        self.add_words(self._parse_word_list(response.content.decode()))
+    def _read_words_from_url(self, url: str) -> List[str]:
+        # Check the scheme up front rather than building a request that
+        # requests will only reject
+        if urllib.parse.urlsplit(url).scheme not in _URL_SCHEMES:
+            print(f"URL {url} is invalid")
+            return []
+        try:
+            # Use the shared session so that files from the same host are
+            # downloaded over the same connection
+            response = self._session.get(url, stream=True, timeout=_URL_TIMEOUT)
+        except requests.exceptions.InvalidURL:
+            print(f"URL {url} is invalid")
+            return []
+        except requests.exceptions.RequestException as error:
+            # Skip hosts that can't be reached rather than stopping entirely
+            print(f"URL {url} failed: {error}")
+            return []
+
+        with response:
+            if not response.ok:
+                print(f"URL {url} returned {response}")
+                return []
+
+            # Parse the words as they are downloaded rather than all at once
+            response.encoding = "utf-8"
+            # Large chunks mean each line is decoded and split along with many
+            # others, rather than a few hundred bytes at a time
+            lines = response.iter_lines(chunk_size=_URL_CHUNK_SIZE, decode_unicode=True)
+            try:
+                return list(self._parse_words(lines))
+            except requests.exceptions.RequestException as error:
+                # The timeout also applies to each read of the download
+                print(f"URL {url} failed: {error}")
+                return []
 
-    def add_words(self, words: List[str]):
+    def add_words(self, words: Iterable[str]):
         """Add words from a list of words.
 
         Args:
-            words (List[str]): The list of words to add.
+            words (Iterable[str]): The list of words to add.
         """
         self._words.update(words)
 
@@ -208,108 +623,359 @@ class TextToSpeech:
         return sorted(self._words)
 
     def _reset_progress_tracker(self):
-        self._progress_tracker = [[0] for _ in range(self._config.n_threads)]
+        # Receives the number of words finished each time some are finished.
+        # Nothing would take them off the queue without a progress bar.
+        self._progress_tracker: Optional[queue.SimpleQueue] = (
+            queue.SimpleQueue() if self._config.progress_bar else None
+        )
 
-    def _create_progress_bar_thread(
-        self, length: int, thread_timeout: float, thread_list: list
-    ):
+    def _record_progress(self, count: int):
+        if self._progress_tracker is not None:
+            self._progress_tracker.put(count)
+
+    def _warm_up_session(self):
+        # Resolve the host and open a connection before the threads start, so
+        # the first requests don't all have to wait for the TLS handshake
+        try:
+            self._session.head(self._translate_url, timeout=_WARM_UP_TIMEOUT)
+        except requests.exceptions.RequestException:
+            # The requests themselves will retry if the host isn't reachable
+            pass
+
+    def _get_existing_files(self) -> Iterator[str]:
+        filename_end = f".{self._config.filetype}"
+        n_chars = len(filename_end)
+        # Yield the words one at a time so that they can be removed from the
+        # word set without building a second set of the whole directory
+        with os.scandir(self._config.output_dir) as entries:
+            for entry in entries:
+                if entry.name[-n_chars:] == filename_end:
+                    yield entry.name[:-n_chars]
+
+    def _create_progress_bar_thread(self, length: int, thread_list: list):
         if self._config.progress_bar:
             pbar = progressbar.ProgressBar(max_value=length)
             thread = threading.Thread(
                 target=self._update_progressbar,
                 daemon=True,
-                args=(pbar, thread_timeout),
+                args=(pbar,),
             )
             thread.start()
             thread_list.append(thread)
 
-    def _create_process_word_thread(
-        self,
-        word_list: list,
-        thread_timeout: float,
-        thread_index: int,
-        thread_list: list,
-    ):
-        thread = threading.Thread(
-            target=self._process_words,
-            daemon=True,
-            args=(word_list, thread_timeout, thread_index),
-        )
+    def _create_write_audio_thread(self, thread_list: list):
+        thread = threading.Thread(target=self._write_audio, daemon=True)
         thread.start()
         thread_list.append(thread)
 
-    @staticmethod
-    def _autoretry_request(request: gtts.gTTS) -> io.BytesIO:
-        mp3_fp = io.BytesIO()
-        timeout = 5
+    def _autoretry_request(self, words: List[str]) -> List[Optional[bytes]]:
+        attempts = 0
+        word_timeout = _INITIAL_RETRY_TIMEOUT
         while True:
+            # Wait out any back off, then wait for this thread's turn to send a
+            # request so that the threads don't all retry at once
+            self._circuit_breaker.wait()
+            self._rate_limiter.acquire()
             try:
-                request.write_to_fp(mp3_fp)
-                return mp3_fp
+                batch_audio = self._client.get_audio_batch(words)
             except gtts.tts.gTTSError as response_error:
                 print(response_error)
-                if not response_error.rsp.ok:
-                    full_traceback = traceback.format_exc()
-                    ind = full_traceback.find("https://")
-                    requests_url = full_traceback[ind:].split("\n", 1)[0]
-                    if not requests_url and not response_error.ok:
-                        raise RuntimeError(
-                            "TTS URL has changed. Full traceback below:\n"
-                            f"{full_traceback}"
-                        ) from response_error
-                    print(f"Failed request. Reauthenticate at {requests_url}")
-                timeout_str = strfseconds(
-                    timeout, formatstring=_TIMEOUT_FSTRING, ndecimal=1
-                )
-                print(f"Retrying in {timeout_str}")
-                time.sleep(timeout)
-                timeout = round(timeout * 2, 2)  # double the timeout each loop
-
-    def _process_words(self, words: list, timeout: float, thread_index: int):
-        filetype = self._config.filetype
-        for word in words:
-            request = gtts.gTTS(
-                word, lang=self._config.language, tld=self._config.locale
-            )
-            mp3_fp = self._autoretry_request(request)
-
-            # Jump to start of mp3_fp so AudioSegment knows where to read
-            mp3_fp.seek(0)
-            audio = pydub.AudioSegment.from_mp3(mp3_fp)
-            output_file = os.path.join(self._config.output_dir, f"{word}.{filetype}")
-            audio.export(output_file, format=filetype, bitrate=self._config.bitrate)
-            # Keep track of current progress
-            self._progress_tracker[thread_index][0] += 1
-            time.sleep(timeout)
-
-    def _update_progressbar(self, pbar, timeout):
-        while pbar.value < pbar.max_value:
-            pbar.update(sum(prog[0] for prog in self._progress_tracker))
-            time.sleep(timeout)
+                if len(words) > 1:
+                    # The batch may have been refused as a whole, so request
+                    # the words on their own rather than retrying the batch
+                    return [None] * len(words)
+                if self._is_outage(response_error):
+                    self._back_off(response_error.rsp)
+                    continue
+                # The API is answering, so only this word is held up
+                attempts += 1
+                if attempts >= _MAX_WORD_ATTEMPTS:
+                    return [None]
+                time.sleep(word_timeout)
+                word_timeout *= 2
+            else:
+                self._circuit_breaker.reset()
+                return batch_audio
 
     @staticmethod
-    def _parse_words(words: List[str]) -> List[str]:
-        return [word for word in words if len(word)]
+    def _is_outage(error: gtts.tts.gTTSError) -> bool:
+        # There's no response if the request couldn't be sent
+        response = error.rsp
+        return response is None or (
+            response.status_code == _TOO_MANY_REQUESTS
+            or response.status_code >= _SERVER_ERROR
+        )
 
-    @staticmethod
-    def _parse_word_list(words: str) -> List[str]:
-        split_words = words.split("\n")
-        return TextToSpeech._parse_words(split_words)
+    def _back_off(self, response: Optional[requests.Response]):
+        if response is not None and response.status_code == _TOO_MANY_REQUESTS:
+            print(f"Failed request. Reauthenticate at {self._translate_url}")
+        timeout = self._circuit_breaker.trip()
+        if timeout is not None:
+            timeout_str = strfseconds(
+                timeout, formatstring=_TIMEOUT_FSTRING, ndecimal=1
+            )
+            print(f"Retrying in {timeout_str}")
 
+    def _get_batches(self) -> Iterator[List[str]]:
+        words = iter(self._words)
+        batch_size = self._config.batch_size
+        while True:
+            batch = list(itertools.islice(words, batch_size))
+            if not batch:
+                return
+            yield batch
 
-def _flatten_arglist(arguments: List[List[str]]):
-    arguments_flattened = []
-    if arguments:
-        for argument_list in arguments:
-            arguments_flattened.extend(argument_list)
-    return arguments_flattened
+    def _process_batches(
+        self,
+        batches: Iterator[List[str]],
+        batches_lock: threading.Lock,
+        stop: threading.Event,
+    ):
+        while not stop.is_set():
+            # Generators can't be used from several threads at once
+            with batches_lock:
+                batch = next(batches, None)
+            if batch is None:
+                return
+            try:
+                self._process_words(batch)
+            except Exception:
+                # Stop the other threads taking more words, so the error is
+                # raised without waiting for every other word
+                stop.set()
+                raise
+
+    def _process_words(self, words: List[str]):
+        requested = []
+        for word in words:
+            if not self._client.has_speech(word):
+                # There would be no audio, and an empty file would look like
+                # it had already been generated on later runs
+                print(f"Skipping {word}, there's nothing to speak")
+                self._record_progress(1)
+                continue
+            output_file = f"{self._output_prefix}{word}.{self._config.filetype}"
+            cache_file = self._get_cache_file(word)
+            # Overwriting generates every word again, but still refreshes the
+            # cache with the new audio
+            if (
+                cache_file is not None
+                and not self._overwrite
+                and os.path.exists(cache_file)
+            ):
+                # Refresh the access time so recently used files are kept
+                os.utime(cache_file)
+                _link_or_copy(cache_file, output_file)
+                # Keep track of current progress
+                self._record_progress(1)
+            else:
+                requested.append((word, output_file, cache_file))
+        if not requested:
+            return
 
+        batch_audio = self._autoretry_request([word for word, _, _ in requested])
+        for (word, output_file, cache_file), audio in zip(requested, batch_audio):
+            if audio is None and len(requested) > 1:
+                # The word wasn't generated with the rest of the batch, so
+                # request it on its own
+                audio = self._autoretry_request([word])[0]
+            if audio is None:
+                print(f"Skipping {word}, no audio after {_MAX_WORD_ATTEMPTS} attempts")
+                self._record_progress(1)
+                continue
+            # Leave the writing to the writer threads so this thread can move
+            # on to the next request
+            self._write_queue.put((audio, output_file, cache_file))
+
+    def _write_audio(self):
+        finished = False
+        while not finished:
+            # Wait for some audio, then take whatever else is waiting so it
+            # can all be written at once
+            batch = []
+            while len(batch) < _MAX_BATCH_SIZE:
+                try:
+                    item = self._write_queue.get(block=not batch)
+                except queue.Empty:
+                    break
+                if item is None:
+                    finished = True
+                    break
+                batch.append(item)
 
-def _main(args: argparse.Namespace):
+            try:
+                self._write_batch(batch)
+            except Exception as error:  # pylint: disable=broad-except
+                if len(batch) == 1:
+                    self._record_write_error(error)
+                else:
+                    # One broken word fails the whole batch, so write the words
+                    # one at a time so that only the broken ones are lost
+                    for item in batch:
+                        try:
+                            self._write_batch([item])
+                        except Exception as item_error:  # pylint: disable=broad-except
+                            self._record_write_error(item_error)
+            finally:
+                # Failed words count too, so the progress bar still finishes
+                if batch:
+                    self._record_progress(len(batch))
+
+    def _write_batch(self, batch: List[Tuple[bytes, str, Optional[str]]]):
+        self._save_audio(
+            [
+                (audio, cache_file or output_file)
+                for audio, output_file, cache_file in batch
+            ]
+        )
+        for _, output_file, cache_file in batch:
+            if cache_file is not None:
+                _link_or_copy(cache_file, output_file)
+
+    def _record_write_error(self, error: Exception):
+        # The writers keep taking audio off the queue so the request threads
+        # can't block on it, and leave the error for run() to raise
+        traceback.print_exception(type(error), error, error.__traceback__)
+        if self._write_error is None:
+            self._write_error = error
+
+    def _save_audio(self, batch: List[Tuple[bytes, str]]):
+        # Write to partial files first so that an interrupted write can't
+        # leave behind a truncated file that looks complete
+        partial_files = [f"{output_file}{_PARTIAL_SUFFIX}" for _, output_file in batch]
+        if self._needs_transcode():
+            _transcode(
+                [audio for audio, _ in batch],
+                partial_files,
+                self._config.filetype,
+                self._config.bitrate,
+            )
+        else:
+            # gTTS already returns mp3 audio, so it can be written as is
+            for (audio, _), partial_file in zip(batch, partial_files):
+                with open(partial_file, "wb") as file:
+                    file.write(audio)
+        for (_, output_file), partial_file in zip(batch, partial_files):
+            os.replace(partial_file, output_file)
+
+    def _get_n_writer_threads(self) -> int:
+        if not self._needs_transcode():
+            # Writing files without transcoding is quick enough for one thread
+            return 1
+        # ffmpeg does the transcoding in a separate process, so threads waiting
+        # on it don't hold the GIL and can make use of every CPU
+        return os.cpu_count() or 1
+
+    def _needs_transcode(self) -> bool:
+        return self._config.filetype != "mp3" or self._config.force_transcode
+
+    def _get_cache_file(self, word: str) -> Optional[str]:
+        if self._config.cache_dir is None:
+            return None
+        key = f"{word}|{self._cache_key_settings}"
+        digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        return os.path.join(self._config.cache_dir, f"{digest}.{self._config.filetype}")
+
+    def _prune_cache(self):
+        if self._config.cache_dir is None:
+            return
+        cached_files = []
+        with os.scandir(self._config.cache_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    cached_files.append((stat.st_atime, stat.st_size, entry.path))
+        cache_size = sum(size for _, size, _ in cached_files)
+        # Remove the least recently used files first
+        for _, size, path in sorted(cached_files):
+            if cache_size <= self._config.max_cache_bytes:
+                break
+            os.remove(path)
+            cache_size -= size
+
+    def _update_progressbar(self, pbar):
+        count = 0
+        while count < pbar.max_value:
+            # Only wake up when a word has been finished, then take any other
+            # updates that are waiting so the bar is redrawn once for all of them
+            count += self._progress_tracker.get()
+            try:
+                while True:
+                    count += self._progress_tracker.get_nowait()
+            except queue.Empty:
+                pass
+            pbar.update(count)
+        # Redraw the bar in full, since updates close together are throttled
+        pbar.finish()
+
+    @staticmethod
+    def _parse_words(words: Iterable[str]) -> Iterator[str]:
+        # Strip surrounding whitespace (including any newlines and carriage
+        # returns) and filter out empty lines
+        return filter(None, map(str.strip, words))
+
+
+def _flatten_arglist(arguments: Optional[List[List[str]]]) -> List[str]:
+    # The arguments are None if they weren't given at all
+    return list(itertools.chain.from_iterable(arguments or ()))
+
+
+def _transcode(
+    audio: List[bytes], output_files: List[str], filetype: str, bitrate: str
+):
+    # A single ffmpeg process transcodes every input to its own output, so
+    # ffmpeg only has to start once for the whole batch. The inputs go
+    # through temporary files rather than a pipe, since ffmpeg can only trim
+    # the mp3 encoder padding from inputs that it can seek in.
+    command = ["ffmpeg", "-nostdin", "-loglevel", "error", "-y"]
+    with tempfile.TemporaryDirectory() as input_dir:
+        for index, input_audio in enumerate(audio):
+            input_file = os.path.join(input_dir, f"{index}.mp3")
+            with open(input_file, "wb") as file:
+                file.write(input_audio)
+            command.extend(["-f", "mp3", "-i", input_file])
+        for index, output_file in enumerate(output_files):
+            command.extend(
+                ["-map", f"{index}:a", "-b:a", bitrate, "-f", filetype, output_file]
+            )
+        try:
+            subprocess.run(
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                check=True,
+            )
+        except subprocess.CalledProcessError as error:
+            # The error doesn't show ffmpeg's output, which says what went wrong
+            raise RuntimeError(
+                f"ffmpeg failed to write {', '.join(output_files)}:\n"
+                f"{error.stderr.decode(errors='replace').strip()}"
+            ) from error
+
+
+def _link_or_copy(source: str, destination: str):
+    # Links can't replace an existing file, so link to a partial file and
+    # replace the destination with that
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        # Already linked, and renaming a link over itself does nothing
+        return
+    partial_file = f"{destination}{_PARTIAL_SUFFIX}"
+    if os.path.lexists(partial_file):
+        os.remove(partial_file)
+    try:
+        os.link(source, partial_file)
+    except OSError:
+        # Hard links aren't supported across filesystems
+        shutil.copyfile(source, partial_file)
+    os.replace(partial_file, destination)
+
+
+def _main(args: argparse.Namespace):  # pylint: disable=too-many-locals
     filenames = _flatten_arglist(args.files)
     urls = _flatten_arglist(args.urls)
     user_words = _flatten_arglist(args.words)
-    bitrate = args.bitrate
+    bitrate = args.bitrate or _DEFAULT_BITRATE
     show_progress = args.show_progress
     overwrite = args.overwrite
     n_threads = args.threads
@@ -318,6 +984,11 @@ def _main(args: argparse.Namespace):
     max_req_per_sec = args.max_req_per_sec
     language = args.language
     locale = args.locale
+    cache_dir = args.cache_dir
+    max_cache_bytes = args.max_cache_bytes
+    # Asking for a specific bitrate only makes sense if the audio is transcoded
+    force_transcode = args.force_transcode or args.bitrate is not None
+    batch_size = args.batch_size
 
     # Create output directory if it doesn't already exist
     if not os.path.exists(output_dir):
@@ -333,6 +1004,10 @@ def _main(args: argparse.Namespace):
             max_per_second=max_req_per_sec,
             language=language,
             locale=locale,
+            cache_dir=cache_dir,
+            max_cache_bytes=max_cache_bytes,
+            force_transcode=force_transcode,
+            batch_size=batch_size,
         ),
         overwrite=overwrite,
     )
@@ -349,6 +1024,16 @@ def _main(args: argparse.Namespace):
         print("No words to process")
 
 
+def _positive_int(argument: str) -> int:
+    try:
+        value = int(argument)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"invalid int value: {argument!r}") from error
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return value
+
+
 def _parse_arguments():
     parser = argparse.ArgumentParser(
         prog="Text to Speech generator",
@@ -382,8 +1067,18 @@ def _parse_arguments():
     parser.add_argument(
         "--bitrate",
         action="store",
-        default=_DEFAULT_BITRATE,
-        help="The exported bitrate in any format supported by ffmpeg.",
+        help="The exported bitrate in any format supported by ffmpeg. If set, the"
+        " audio is always transcoded. Otherwise, mp3 audio is written as is and"
+        f" other formats are transcoded at {_DEFAULT_BITRATE}.",
+    )
+    parser.add_argument(
+        "--force-transcode",
+        dest="force_transcode",
+        action="store_true",
+        help="If set, mp3 audio will be transcoded even if no bitrate is given, at"
+        f" {_DEFAULT_BITRATE}."
+        " Otherwise, the ~32k mp3 audio returned by Google is written as is."
+        " Audio in other formats is always transcoded.",
     )
     parser.add_argument(
         "--progress",
@@ -400,9 +1095,10 @@ def _parse_arguments():
         "-T",
         "--threads",
         action="store",
-        type=int,
+        type=_positive_int,
         default=_DEFAULT_N_THREADS,
-        help="The number of threads to run when generating audio.",
+        help="The number of threads to run when generating audio. This is the"
+        " maximum number of requests waiting for a response at once.",
     )
     parser.add_argument(
         "-o",
@@ -431,6 +1127,16 @@ def _parse_arguments():
         help="The maximum number of requests per second. The lower the number,"
         " the more words that will be generated before requests are rejected.",
     )
+    parser.add_argument(
+        "--batch-size",
+        dest="batch_size",
+        action="store",
+        type=_positive_int,
+        default=_DEFAULT_BATCH_SIZE,
+        help="The maximum number of words to send in each request. Words missing"
+        " from a batched response, or in a batch that fails, are requested on"
+        " their own.",
+    )
     languages = list(gtts.lang.tts_langs().keys())
     parser.add_argument(
         "--language",
@@ -449,6 +1155,32 @@ def _parse_arguments():
         help="The accent to generate audio in. More information here:"
         " https://gtts.readthedocs.io/en/latest/module.html#localized-accents",
     )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        action="store",
+        type=str,
+        default=_DEFAULT_CACHE_DIR,
+        help="The directory to cache generated audio in. Words that have been"
+        " generated before with the same settings are copied from the cache"
+        " instead of being requested again.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="cache_dir",
+        action="store_const",
+        const=None,
+        help="If set, generated audio will not be cached.",
+    )
+    parser.add_argument(
+        "--max-cache-bytes",
+        dest="max_cache_bytes",
+        action="store",
+        type=int,
+        default=_DEFAULT_MAX_CACHE_BYTES,
+        help="The maximum size of the cache in bytes. The least recently used"
+        " files are removed once this is exceeded.",
+    )
 
     return parser.parse_args()
 